@@ -21,12 +21,22 @@
 """Create enum to string functions for vulkan using vk.xml."""
 
 import argparse
+import collections
+import filecmp
 import functools
+import operator
 import os
 import re
+import sys
+import tempfile
 import textwrap
-import xml.etree.ElementTree as et
 
+try:
+    from lxml import etree as et
+except ImportError:
+    import xml.etree.ElementTree as et
+
+from mako.runtime import Context
 from mako.template import Template
 
 COPYRIGHT = textwrap.dedent(u"""\
@@ -50,13 +60,14 @@ COPYRIGHT = textwrap.dedent(u"""\
     * OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
     * SOFTWARE.""")
 
-C_TEMPLATE = Template(textwrap.dedent(u"""\
+C_TEMPLATE = textwrap.dedent(u"""\
     /* Autogenerated file -- do not edit
      * generated by ${file}
      *
      ${copyright}
      */
 
+    #include <stdlib.h>
     #include <string.h>
     #include <vulkan/vulkan.h>
     #include <vulkan/vk_android_native_buffer.h>
@@ -64,34 +75,119 @@ C_TEMPLATE = Template(textwrap.dedent(u"""\
     #include "util/macros.h"
     #include "vk_enum_to_str.h"
 
+    struct vk_enum_to_str_entry {
+        int64_t value;
+        const char *name;
+    };
+
+    static int
+    vk_enum_to_str_compare(const void *key, const void *elem)
+    {
+        const int64_t a = *(const int64_t *)key;
+        const int64_t b = ((const struct vk_enum_to_str_entry *)elem)->value;
+        return (a > b) - (a < b);
+    }
+
+    static UNUSED const char *
+    vk_enum_to_str_lookup(const struct vk_enum_to_str_entry *entries,
+                          size_t count, int64_t value)
+    {
+        const struct vk_enum_to_str_entry *entry =
+            bsearch(&value, entries, count, sizeof(*entries),
+                    vk_enum_to_str_compare);
+        return entry != NULL ? entry->name : NULL;
+    }
+
     % for enum in enums:
 
       % if enum.guard:
 #ifdef ${enum.guard}
       % endif
+      % if enum.is_dense():
+<% min_value = enum.sorted_items[0][0] %>\
+    static const char * const vk_${enum.name[2:]}_names[] = {
+    % for v, name in enum.sorted_items:
+        [${v - min_value}] = "${name}",
+    % endfor
+    };
+
     const char *
     vk_${enum.name[2:]}_to_str(${enum.name} input)
     {
-        switch((int64_t)input) {
-    % for v in sorted(enum.values.keys()):
-        case ${v}:
-            return "${enum.values[v]}";
+        const int64_t index = (int64_t)input - (${min_value});
+        if (index >= 0 && index < (int64_t)ARRAY_SIZE(vk_${enum.name[2:]}_names) &&
+            vk_${enum.name[2:]}_names[index] != NULL)
+            return vk_${enum.name[2:]}_names[index];
+        if (input == ${enum.max_enum_name})
+            return "${enum.max_enum_name}";
+        return "Unknown ${enum.name} value.";
+    }
+      % else:
+    /* Sorted by value so it can be searched with bsearch(). */
+    static const struct vk_enum_to_str_entry vk_${enum.name[2:]}_entries[] = {
+    % for v, name in enum.sorted_items:
+        { ${v}, "${name}" },
     % endfor
-        case ${enum.max_enum_name}: return "${enum.max_enum_name}";
-        default:
-            return "Unknown ${enum.name} value.";
-        }
+        { ${enum.max_enum_name}, "${enum.max_enum_name}" },
+    };
+
+    const char *
+    vk_${enum.name[2:]}_to_str(${enum.name} input)
+    {
+        const char *name =
+            vk_enum_to_str_lookup(vk_${enum.name[2:]}_entries,
+                                  ARRAY_SIZE(vk_${enum.name[2:]}_entries),
+                                  (int64_t)input);
+        return name != NULL ? name : "Unknown ${enum.name} value.";
     }
+      % endif
 
       % if enum.guard:
 #endif
       % endif
     %endfor
 
+    struct vk_structure_type_size_entry {
+        VkStructureType stype;
+        size_t size;
+    };
+
+    /* Sorted by sType value so it can be searched with bsearch(). */
+    static const struct vk_structure_type_size_entry vk_structure_type_sizes[] = {
+    % for struct in structs:
+        % if struct.extension is not None and struct.extension.define is not None:
+    #ifdef ${struct.extension.define}
+        { ${struct.stype}, sizeof(${struct.name}) },
+    #endif
+        % else:
+        { ${struct.stype}, sizeof(${struct.name}) },
+        % endif
+    %endfor
+    };
+
+    static int
+    vk_structure_type_size_compare(const void *key, const void *elem)
+    {
+        const int32_t a = *(const VkStructureType *)key;
+        const int32_t b = ((const struct vk_structure_type_size_entry *)elem)->stype;
+        return (a > b) - (a < b);
+    }
+
     size_t vk_structure_type_size(const struct VkBaseInStructure *item)
     {
+        const struct vk_structure_type_size_entry *entry =
+            bsearch(&item->sType, vk_structure_type_sizes,
+                    ARRAY_SIZE(vk_structure_type_sizes),
+                    sizeof(vk_structure_type_sizes[0]),
+                    vk_structure_type_size_compare);
+        if (entry != NULL)
+            return entry->size;
+
+        /* sTypes from extensions vk.xml does not enable, whose values are
+         * only known to the C compiler.
+         */
         switch((int)item->sType) {
-    % for struct in structs:
+    % for struct in extra_structs:
         % if struct.extension is not None and struct.extension.define is not None:
     #ifdef ${struct.extension.define}
         case ${struct.stype}: return sizeof(${struct.name});
@@ -100,8 +196,6 @@ C_TEMPLATE = Template(textwrap.dedent(u"""\
         case ${struct.stype}: return sizeof(${struct.name});
         % endif
     %endfor
-        case VK_STRUCTURE_TYPE_LOADER_INSTANCE_CREATE_INFO: return sizeof(VkLayerInstanceCreateInfo);
-        case VK_STRUCTURE_TYPE_LOADER_DEVICE_CREATE_INFO: return sizeof(VkLayerDeviceCreateInfo);
         default:
             unreachable("Undefined struct type.");
         }
@@ -119,9 +213,9 @@ C_TEMPLATE = Template(textwrap.dedent(u"""\
             return "Unknown VkObjectType value.";
         }
     }
-    """))
+    """)
 
-H_TEMPLATE = Template(textwrap.dedent(u"""\
+H_TEMPLATE = textwrap.dedent(u"""\
     /* Autogenerated file -- do not edit
      * generated by ${file}
      *
@@ -156,10 +250,10 @@ H_TEMPLATE = Template(textwrap.dedent(u"""\
     } /* extern "C" */
     #endif
 
-    #endif"""))
+    #endif""")
 
 
-H_DEFINE_TEMPLATE = Template(textwrap.dedent(u"""\
+H_DEFINE_TEMPLATE = textwrap.dedent(u"""\
     /* Autogenerated file -- do not edit
      * generated by ${file}
      *
@@ -180,10 +274,7 @@ H_DEFINE_TEMPLATE = Template(textwrap.dedent(u"""\
     #define _${ext.name}_number (${ext.number})
     % endfor
 
-    % for enum in bitmasks:
-      % if enum.bitwidth > 32:
-        <% continue %>
-      % endif
+    % for enum in bitmasks_32:
       % if enum.guard:
 #ifdef ${enum.guard}
       % endif
@@ -193,15 +284,12 @@ H_DEFINE_TEMPLATE = Template(textwrap.dedent(u"""\
       % endif
     % endfor
 
-    % for enum in bitmasks:
-      % if enum.bitwidth < 64:
-        <% continue %>
-      % endif
+    % for enum in bitmasks_64:
     /* Redefine bitmask values of ${enum.name} */
       % if enum.guard:
 #ifdef ${enum.guard}
       % endif
-      % for n, v in enum.name_to_value.items():
+      % for n, v in enum.sorted_name_to_value:
     #define ${n} (${hex(v)}ULL)
       % endfor
       % if enum.guard:
@@ -219,7 +307,13 @@ H_DEFINE_TEMPLATE = Template(textwrap.dedent(u"""\
     } /* extern "C" */
     #endif
 
-    #endif"""))
+    #endif""")
+
+
+@functools.lru_cache(maxsize=None)
+def get_template(source):
+    """Compile a template source once and reuse it for later renders."""
+    return Template(source)
 
 
 class NamedFactory(object):
@@ -230,9 +324,8 @@ class NamedFactory(object):
         self.type = type_
 
     def __call__(self, name, **kwargs):
-        try:
-            return self.registry[name]
-        except KeyError:
+        n = self.registry.get(name)
+        if n is None:
             n = self.registry[name] = self.type(name, **kwargs)
         return n
 
@@ -249,14 +342,25 @@ class VkExtension(object):
         self.define = define
 
 
+CAMEL_CASE_RE = re.compile(r'(?<![A-Z])([A-Z])')
+
+# Those special prefixes need to be always at the end
+MAX_ENUM_SUFFIXES = frozenset(['AMD', 'EXT', 'INTEL', 'KHR', 'NV', 'LUNARG'])
+
 def CamelCase_to_SHOUT_CASE(s):
-   return (s[:1] + re.sub(r'(?<![A-Z])([A-Z])', r'_\1', s[1:])).upper()
+   return (s[:1] + CAMEL_CASE_RE.sub(r'_\1', s[1:])).upper()
+
+# The same bit positions, offsets and extension numbers show up over and over
+# again in vk.xml.
+@functools.lru_cache(maxsize=4096)
+def parse_int(s, base=10):
+    return int(s, base=base)
 
+@functools.lru_cache(maxsize=None)
 def compute_max_enum_name(s):
     max_enum_name = CamelCase_to_SHOUT_CASE(s)
     last_prefix = max_enum_name.rsplit('_', 1)[-1]
-    # Those special prefixes need to be always at the end
-    if last_prefix in ['AMD', 'EXT', 'INTEL', 'KHR', 'NV', 'LUNARG'] :
+    if last_prefix in MAX_ENUM_SUFFIXES:
         max_enum_name = "_".join(max_enum_name.split('_')[:-1])
         max_enum_name = max_enum_name + "_MAX_ENUM_" + last_prefix
     else:
@@ -274,9 +378,28 @@ class VkEnum(object):
         self.extension = None
         # Maps numbers to names
         self.values = values or dict()
+        self._all_bits = functools.reduce(operator.or_, self.values, 0)
         self.name_to_value = dict()
         self.guard = None
-        self.name_to_alias_list = {}
+        self.name_to_alias_list = collections.defaultdict(list)
+        self._sorted_items = None
+        self._sorted_name_to_value = None
+
+    @property
+    def sorted_items(self):
+        """(value, name) pairs sorted by value."""
+        if self._sorted_items is None:
+            self._sorted_items = sorted(self.values.items())
+        return self._sorted_items
+
+    @property
+    def sorted_name_to_value(self):
+        """(name, value) pairs sorted by value, then name, so that the
+        generated defines do not depend on the order of the XML."""
+        if self._sorted_name_to_value is None:
+            self._sorted_name_to_value = tuple(sorted(
+                self.name_to_value.items(), key=operator.itemgetter(1, 0)))
+        return self._sorted_name_to_value
 
     def all_bits_name(self):
         assert self.name.startswith('Vk')
@@ -284,19 +407,29 @@ class VkEnum(object):
 
         return 'VK_ALL_' + CamelCase_to_SHOUT_CASE(self.name[2:])
 
+    def is_dense(self):
+        """Whether the values are packed tightly enough for a direct-indexed
+        string array to be smaller than a sorted table."""
+        if not self.values:
+            return False
+        return max(self.values) - min(self.values) < 2 * len(self.values)
+
     def all_bits_value(self):
-        return functools.reduce(lambda a,b: a | b, self.values.keys(), 0)
+        return self._all_bits
 
     def add_value(self, name, value=None,
                   extnum=None, offset=None, alias=None,
                   error=False):
+        # The same names end up as keys and values of several dicts, share a
+        # single copy of each.
+        name = sys.intern(name)
         if alias is not None:
+            alias = sys.intern(alias)
             assert value is None and offset is None
             if alias not in self.name_to_value:
                 # We don't have this alias yet.  Just record the alias and
                 # we'll deal with it later.
-                alias_list = self.name_to_alias_list.setdefault(alias, [])
-                alias_list.append(name);
+                self.name_to_alias_list[alias].append(name)
                 return
 
             # Use the value from the alias
@@ -308,38 +441,53 @@ class VkEnum(object):
             if error:
                 value = -value
 
+        # Now that the value is known, resolve aliases, if any.  Aliases of
+        # aliases are pushed in reverse so they are visited depth-first in
+        # the order they were recorded.
+        pending = [name]
+        while pending:
+            name = pending.pop()
+            self._set_value(name, value)
+            pending.extend(reversed(self.name_to_alias_list.pop(name, ())))
+
+    def _set_value(self, name, value):
         self.name_to_value[name] = value
+        self._all_bits |= value
+        self._sorted_items = None
+        self._sorted_name_to_value = None
         if value not in self.values:
             self.values[value] = name
         elif len(self.values[value]) > len(name):
             self.values[value] = name
 
-        # Now that the value has been fully added, resolve aliases, if any.
-        if name in self.name_to_alias_list:
-            for alias in self.name_to_alias_list[name]:
-                self.add_value(alias, value)
-            del self.name_to_alias_list[name]
-
     def add_value_from_xml(self, elem, extension=None):
         self.extension = extension
-        if 'value' in elem.attrib:
-            self.add_value(elem.attrib['name'],
-                           value=int(elem.attrib['value'], base=0))
-        elif 'bitpos' in elem.attrib:
-            self.add_value(elem.attrib['name'],
-                           value=(1 << int(elem.attrib['bitpos'], base=0)))
-        elif 'alias' in elem.attrib:
-            self.add_value(elem.attrib['name'], alias=elem.attrib['alias'])
+        name = elem.get('name')
+        value = elem.get('value')
+        if value is not None:
+            self.add_value(name, value=parse_int(value, 0))
+            return
+
+        bitpos = elem.get('bitpos')
+        if bitpos is not None:
+            self.add_value(name, value=(1 << parse_int(bitpos, 0)))
+            return
+
+        alias = elem.get('alias')
+        if alias is not None:
+            self.add_value(name, alias=alias)
+            return
+
+        error = elem.get('dir') == '-'
+        extnum = elem.get('extnumber')
+        if extnum is not None:
+            extnum = parse_int(extnum)
         else:
-            error = 'dir' in elem.attrib and elem.attrib['dir'] == '-'
-            if 'extnumber' in elem.attrib:
-                extnum = int(elem.attrib['extnumber'])
-            else:
-                extnum = extension.number
-            self.add_value(elem.attrib['name'],
-                           extnum=extnum,
-                           offset=int(elem.attrib['offset']),
-                           error=error)
+            extnum = extension.number
+        self.add_value(name,
+                       extnum=extnum,
+                       offset=parse_int(elem.get('offset')),
+                       error=error)
 
     def set_guard(self, g):
         self.guard = g
@@ -354,11 +502,14 @@ class VkChainStruct(object):
 
 
 def struct_get_stype(xml_node):
-    for member in xml_node.findall('./member'):
-        name = member.findall('./name')
-        if len(name) > 0 and name[0].text == "sType":
-            return member.get('values')
-    return None
+    # sType is always the first member of structs that have one.
+    member = xml_node.find('./member')
+    if member is None:
+        return None
+    name = member.find('./name')
+    if name is None or name.text != "sType":
+        return None
+    return member.get('values')
 
 class VkObjectType(object):
     """Simple struct-like class representing a single Vulkan object type"""
@@ -367,83 +518,131 @@ class VkObjectType(object):
         self.enum_to_name = dict()
 
 
+def walk_registry_elements(tree):
+    """Yield (parent tag, element) for every element one or two levels below
+    <registry>, children before their parent.
+    """
+
+    root = tree.getroot()
+    for child in root:
+        for grandchild in child:
+            yield child.tag, grandchild
+        yield root.tag, child
+
+
 def parse_xml(enum_factory, ext_factory, struct_factory, bitmask_factory,
-              obj_type_factory, filename):
-    """Parse the XML file. Accumulate results into the factories.
+              obj_type_factory, elements):
+    """Parse the registry elements. Accumulate results into the factories.
 
-    This parser is a memory efficient iterative XML parser that returns a list
-    of VkEnum objects.
+    Elements of interest are either direct children of <registry> (<enums>,
+    <feature>) or of one of its container nodes (<types>, <platforms>,
+    <extensions>).  Everything else is skipped.
     """
 
-    xml = et.parse(filename)
-
-    for enum_type in xml.findall('./enums[@type="enum"]'):
-        enum = enum_factory(enum_type.attrib['name'])
-        for value in enum_type.findall('./enum'):
-            enum.add_value_from_xml(value)
-
-    # For bitmask we only add the Enum selected for convenience.
-    for enum_type in xml.findall('./enums[@type="bitmask"]'):
-        bitwidth = int(enum_type.attrib.get('bitwidth', 32))
-        enum = bitmask_factory(enum_type.attrib['name'], bitwidth=bitwidth)
-        for value in enum_type.findall('./enum'):
-            enum.add_value_from_xml(value)
-
-    for value in xml.findall('./feature/require/enum[@extends]'):
-        extends = value.attrib['extends']
-        enum = enum_factory.get(extends)
-        if enum is not None:
-            enum.add_value_from_xml(value)
-        enum = bitmask_factory.get(extends)
-        if enum is not None:
-            enum.add_value_from_xml(value)
-
-    for struct_type in xml.findall('./types/type[@category="struct"]'):
-        name = struct_type.attrib['name']
-        stype = struct_get_stype(struct_type)
-        if stype is not None:
-            struct_factory(name, stype=stype)
-
     platform_define = {}
-    for platform in xml.findall('./platforms/platform'):
-        name = platform.attrib['name']
-        define = platform.attrib['protect']
-        platform_define[name] = define
-
-    for ext_elem in xml.findall('./extensions/extension[@supported="vulkan"]'):
-        define = None
-        if "platform" in ext_elem.attrib:
-            define = platform_define[ext_elem.attrib['platform']]
-        extension = ext_factory(ext_elem.attrib['name'],
-                                number=int(ext_elem.attrib['number']),
-                                define=define)
-
-        for value in ext_elem.findall('./require/enum[@extends]'):
-            extends = value.attrib['extends']
-            enum = enum_factory.get(extends)
-            if enum is not None:
-                enum.add_value_from_xml(value, extension)
-            enum = bitmask_factory.get(extends)
-            if enum is not None:
-                enum.add_value_from_xml(value, extension)
-        for t in ext_elem.findall('./require/type'):
-            struct = struct_factory.get(t.attrib['name'])
-            if struct is not None:
-                struct.extension = extension
-
-        if define:
-            for value in ext_elem.findall('./require/type[@name]'):
-                enum = enum_factory.get(value.attrib['name'])
-                if enum is not None:
-                    enum.set_guard(define)
+    handle_enums = []
+
+    # <require><enum extends=...> entries of features and extensions, grouped
+    # by the enum they extend, along with the extension requiring them.
+    pending_extends = collections.defaultdict(list)
+
+    for parent, elem in elements:
+        if parent in ('enums', 'feature'):
+            # Read along with the enclosing element once it is complete.
+            continue
+
+        if parent == 'registry' and elem.tag == 'enums':
+            enum_type = elem.get('type')
+            if enum_type == 'enum':
+                enum = enum_factory(elem.get('name'))
+                for value in elem.findall('./enum'):
+                    enum.add_value_from_xml(value)
+            elif enum_type == 'bitmask':
+                # For bitmask we only add the Enum selected for convenience.
+                bitwidth = int(elem.get('bitwidth', 32))
+                enum = bitmask_factory(elem.get('name'), bitwidth=bitwidth)
+                for value in elem.findall('./enum'):
+                    enum.add_value_from_xml(value)
+        elif parent == 'registry' and elem.tag == 'feature':
+            for value in elem.findall('./require/enum[@extends]'):
+                pending_extends[value.get('extends')].append((value, None))
+        elif parent == 'types' and elem.tag == 'type':
+            category = elem.get('category')
+            if category == 'struct':
+                name = elem.attrib['name']
+                stype = struct_get_stype(elem)
+                if stype is not None:
+                    struct_factory(name, stype=stype)
+            elif category == 'handle':
+                # VkObjectType is only defined further down in the file, so
+                # resolve the handles once the whole file has been read.
+                for object_name in elem.findall('./name'):
+                    handle_enums.append((elem.attrib['objtypeenum'],
+                                         object_name.text))
+        elif parent == 'platforms' and elem.tag == 'platform':
+            platform_define[elem.attrib['name']] = elem.attrib['protect']
+        elif parent == 'extensions' and elem.tag == 'extension':
+            if elem.get('supported') == 'vulkan':
+                parse_extension(enum_factory, ext_factory, struct_factory,
+                                pending_extends, platform_define, elem)
+
+        # Everything we need from this element has been extracted, or it is
+        # of no interest at all.  Free it as we go so the memory held by the
+        # tree shrinks while the rest of it is processed.
+        elem.clear()
+
+    # Now that every enum of the file is known, add the extension values one
+    # extended enum at a time.  Enums and bitmasks never share a name.
+    for extends, values in pending_extends.items():
+        enum = enum_factory.get(extends) or bitmask_factory.get(extends)
+        if enum is None:
+            continue
+        for value, extension in values:
+            enum.add_value_from_xml(value, extension)
 
     obj_types = obj_type_factory("VkObjectType")
-    for object_type in xml.findall('./types/type[@category="handle"]'):
-        for object_name in object_type.findall('./name'):
-            # Convert to int to avoid undefined enums
-            enum = object_type.attrib['objtypeenum']
-            enum_val = enum_factory.get("VkObjectType").name_to_value[enum]
-            obj_types.enum_to_name[enum_val] = object_name.text
+    if not handle_enums:
+        # Supplementary registries may not define VkObjectType at all.
+        return
+    obj_type_values = enum_factory.get("VkObjectType").name_to_value
+    for enum, object_name in handle_enums:
+        # Convert to int to avoid undefined enums
+        obj_types.enum_to_name[obj_type_values[enum]] = object_name
+
+
+def parse_extension(enum_factory, ext_factory, struct_factory,
+                    pending_extends, platform_define, ext_elem):
+    define = None
+    if "platform" in ext_elem.attrib:
+        define = platform_define[ext_elem.attrib['platform']]
+    extension = ext_factory(ext_elem.attrib['name'],
+                            number=int(ext_elem.attrib['number']),
+                            define=define)
+
+    for value in ext_elem.findall('./require/enum[@extends]'):
+        pending_extends[value.get('extends')].append((value, extension))
+    for t in ext_elem.findall('./require/type'):
+        struct = struct_factory.get(t.attrib['name'])
+        if struct is not None:
+            struct.extension = extension
+
+    if define:
+        for value in ext_elem.findall('./require/type[@name]'):
+            enum = enum_factory.get(value.attrib['name'])
+            if enum is not None:
+                enum.set_guard(define)
+
+
+def replace_if_changed(tmp, filename):
+    """Move tmp over filename unless filename already has the same contents.
+
+    Leaving an up to date file untouched keeps its timestamp, so ninja does
+    not rebuild everything that includes the generated headers.
+    """
+    if os.path.exists(filename) and filecmp.cmp(tmp, filename, shallow=False):
+        os.remove(tmp)
+    else:
+        os.replace(tmp, filename)
 
 
 def main():
@@ -466,25 +665,74 @@ def main():
 
     for filename in args.xml_files:
         parse_xml(enum_factory, ext_factory, struct_factory, bitmask_factory,
-                  obj_type_factory, filename)
-    enums = sorted(enum_factory.registry.values(), key=lambda e: e.name)
-    extensions = sorted(ext_factory.registry.values(), key=lambda e: e.name)
-    structs = sorted(struct_factory.registry.values(), key=lambda e: e.name)
-    bitmasks = sorted(bitmask_factory.registry.values(), key=lambda e: e.name)
-    object_types = sorted(obj_type_factory.registry.values(), key=lambda e: e.name)
+                  obj_type_factory, walk_registry_elements(et.parse(filename)))
+    by_name = operator.attrgetter('name')
+    enums = sorted(enum_factory.registry.values(), key=by_name)
+    extensions = sorted(ext_factory.registry.values(), key=by_name)
+
+    # The loader structs live in vk_layer.h rather than vk.xml.
+    struct_factory('VkLayerInstanceCreateInfo',
+                   stype='VK_STRUCTURE_TYPE_LOADER_INSTANCE_CREATE_INFO')
+    struct_factory('VkLayerDeviceCreateInfo',
+                   stype='VK_STRUCTURE_TYPE_LOADER_DEVICE_CREATE_INFO')
+
+    # vk_structure_type_size() does a binary search over the structs so they
+    # have to be sorted by their sType value.  The few whose sType is not
+    # known here get a plain switch instead.
+    stype_values = enum_factory.get('VkStructureType').name_to_value
+    structs = sorted((s for s in struct_factory.registry.values()
+                      if s.stype in stype_values),
+                     key=lambda e: stype_values[e.stype])
+    extra_structs = sorted((s for s in struct_factory.registry.values()
+                            if s.stype not in stype_values),
+                           key=by_name)
+    del stype_values
+    bitmasks = sorted(bitmask_factory.registry.values(), key=by_name)
+
+    # Past this point only the 64-bit bitmasks need their name -> value map,
+    # for the defines header.  Empty the others so they are not kept around
+    # while rendering.
+    for enum in enums + bitmasks:
+        if enum.bitwidth < 64:
+            enum.name_to_value.clear()
+    object_types = sorted(obj_type_factory.registry.values(), key=by_name)
+
+    bitmasks_32 = [b for b in bitmasks if b.bitwidth <= 32]
+    bitmasks_64 = [b for b in bitmasks if b.bitwidth >= 64]
+
+    umask = os.umask(0)
+    os.umask(umask)
 
     for template, file_ in [(C_TEMPLATE, os.path.join(args.outdir, 'vk_enum_to_str.c')),
                             (H_TEMPLATE, os.path.join(args.outdir, 'vk_enum_to_str.h')),
                             (H_DEFINE_TEMPLATE, os.path.join(args.outdir, 'vk_enum_defines.h'))]:
-        with open(file_, 'w', encoding='utf-8') as f:
-            f.write(template.render(
-                file=os.path.basename(__file__),
-                enums=enums,
-                extensions=extensions,
-                structs=structs,
-                bitmasks=bitmasks,
-                object_types=object_types,
-                copyright=COPYRIGHT))
+        # Write the output as it is rendered rather than building the whole
+        # file as one string first.  Use a unique temporary file so that
+        # concurrent runs don't write over each other.
+        f = tempfile.NamedTemporaryFile('w', encoding='utf-8',
+                                        dir=args.outdir,
+                                        prefix=os.path.basename(file_) + '.',
+                                        suffix='.tmp', delete=False)
+        try:
+            with f:
+                get_template(template).render_context(Context(
+                    f,
+                    file=os.path.basename(__file__),
+                    enums=enums,
+                    extensions=extensions,
+                    structs=structs,
+                    extra_structs=extra_structs,
+                    bitmasks_32=bitmasks_32,
+                    bitmasks_64=bitmasks_64,
+                    object_types=object_types,
+                    copyright=COPYRIGHT))
+            # Temporary files are only accessible by their owner, give the
+            # output the permissions a plain open() would have.
+            os.chmod(f.name, 0o666 & ~umask)
+        except BaseException:
+            os.remove(f.name)
+            raise
+        replace_if_changed(f.name, file_)
 
 
 if __name__ == '__main__':